@@ -1,9 +1,11 @@
 from flask import Flask, render_template, request, jsonify
-from crawler import crawl_async
+from crawler import crawl_async, close_session, invalidate_crawl_cache
 from embeddings import EmbeddingEngine
 from summarizer_async import AsyncSummarizer as Summarizer
 import asyncio
+import atexit
 import logging
+import threading
 
 # --------------------------------------------------
 # 🔧 Setup & Initialization
@@ -15,6 +17,20 @@ logging.getLogger("transformers").setLevel(logging.ERROR)
 engine = EmbeddingEngine("sentence-transformers/all-MiniLM-L6-v2")
 summarizer = Summarizer()
 
+# One long-lived event loop (in a daemon thread), shared by every request
+# instead of a fresh asyncio.run() loop per call
+LOOP = asyncio.new_event_loop()
+threading.Thread(target=LOOP.run_forever, name="async-loop", daemon=True).start()
+
+
+def run_async(coro):
+    """Run a coroutine on the shared loop and block until it finishes."""
+    return asyncio.run_coroutine_threadsafe(coro, LOOP).result()
+
+
+# Close the crawler's shared HTTP session on shutdown
+atexit.register(lambda: run_async(close_session()))
+
 # --------------------------------------------------
 # 🧠 Helper: Run concurrent crawls
 # --------------------------------------------------
@@ -53,8 +69,13 @@ def crawl():
 
     print(f"🌐 Crawl initiated for: {url1 or url2}")
 
-    # ✅ Run async concurrent crawl with asyncio.run
-    all_pages, all_blocked = asyncio.run(crawl_concurrently([url1, url2], query=""))
+    # An explicit crawl always refetches
+    for url in (url1, url2):
+        if url:
+            invalidate_crawl_cache(url)
+
+    # ✅ Run async concurrent crawl on the shared loop
+    all_pages, all_blocked = run_async(crawl_concurrently([url1, url2], query=""))
 
     if not all_pages:
         return jsonify({
@@ -63,10 +84,8 @@ def crawl():
             "blocked": all_blocked
         }), 400
 
-    # ✅ Run build_index in background thread
-    import concurrent.futures
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        executor.submit(engine.build_index, all_pages)
+    # ✅ Build embeddings (Flask already runs each request on its own thread)
+    engine.build_index(all_pages)
 
     message = f"✅ Crawled {len(all_pages)} pages successfully!"
     if all_blocked:
@@ -102,21 +121,21 @@ def search():
     # Crawl primary site
     if url1:
         print(f"🌐 Crawling primary: {url1}")
-        pages1, blocked1 = asyncio.run(crawl_concurrently([url1], query=query))
+        pages1, blocked1 = run_async(crawl_concurrently([url1], query=query))
         all_pages.extend(pages1)
         all_blocked.extend(blocked1)
 
     # Crawl secondary site
     if url2:
         print(f"🌐 Crawling secondary: {url2}")
-        pages2, blocked2 = asyncio.run(crawl_concurrently([url2], query=query))
+        pages2, blocked2 = run_async(crawl_concurrently([url2], query=query))
         all_pages.extend(pages2)
         all_blocked.extend(blocked2)
 
     # Fallback to Wikipedia if nothing found
     if not all_pages:
         print("⚠️ No data from domains — using Wikipedia fallback.")
-        fallback, blocked_fallback = asyncio.run(
+        fallback, blocked_fallback = run_async(
             crawl_async("https://en.wikipedia.org/wiki/Main_Page", max_pages=2)
         )
         all_pages.extend(fallback)
@@ -137,10 +156,7 @@ def search():
     # ---- SAFE HYBRID SEARCH ----
     results = []  # always defined
     try:
-        import concurrent.futures
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            future = executor.submit(engine.search, query, 7, 0.7)
-            results = future.result()
+        results = engine.search(query, 7, 0.7)
     except Exception as e:
         print(f"❌ Search error: {e}")
         return jsonify({
@@ -164,10 +180,7 @@ def search():
         print("🧠 Smart Mode enabled — summarizing asynchronously...")
         combined_text = " ".join([r["content"] for r in results])
         try:
-            summary = asyncio.run(summarizer.summarize(combined_text, query))
-        except RuntimeError:
-            loop = asyncio.get_event_loop()
-            summary = loop.run_until_complete(summarizer.summarize(combined_text, query))
+            summary = run_async(summarizer.summarize(combined_text, query))
         except Exception as e:
             print(f"⚠️ Summarizer error: {e}")
             summary = "Unable to summarize content."
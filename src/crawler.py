@@ -1,9 +1,12 @@
 import aiohttp
 import asyncio
-from bs4 import BeautifulSoup
+from selectolax.parser import HTMLParser
 from urllib.parse import urljoin, urlparse
 from urllib import robotparser
-import json
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict, deque
+import functools
+import orjson
 import os
 import random
 import time
@@ -16,6 +19,56 @@ USER_AGENTS = [
     "Mozilla/5.0 (iPhone; CPU iPhone OS 17_1 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 Mobile/15E148 Safari/604.1",
 ]
 
+# Shared pool for blocking work (robots.txt reads, HTML parsing) so it
+# never runs on the event loop. Kept at module level: asyncio.run() shuts
+# down a loop's default executor, which would break reuse across crawls.
+EXECUTOR = ThreadPoolExecutor(max_workers=int(os.getenv("THREAD_POOL_SIZE", 32)))
+
+
+async def run_blocking(func, *args):
+    """Run a blocking call on the shared crawler thread pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(EXECUTOR, func, *args)
+
+
+# ------------------ Shared HTTP Session ------------------
+# One keep-alive connection pool (with DNS cache) reused by every crawl on
+# the same event loop; recreated if the loop changes (e.g. asyncio.run).
+_SESSION = None
+_SESSION_LOOP = None
+
+
+async def _get_session():
+    """Return the shared aiohttp session for the running loop."""
+    global _SESSION, _SESSION_LOOP
+    loop = asyncio.get_running_loop()
+    if _SESSION is None or _SESSION.closed or _SESSION_LOOP is not loop:
+        connector = aiohttp.TCPConnector(limit=100, limit_per_host=10, ttl_dns_cache=300, keepalive_timeout=30)
+        _SESSION = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=15))
+        _SESSION_LOOP = loop
+    return _SESSION
+
+
+async def close_session():
+    """Close the shared session (call on shutdown)."""
+    global _SESSION, _SESSION_LOOP
+    if _SESSION is not None and not _SESSION.closed:
+        await _SESSION.close()
+    _SESSION = _SESSION_LOOP = None
+
+
+# ------------------ Crawl Result Cache ------------------
+# (start_url, max_pages, max_depth, query) → (pages, blocked, timestamp)
+CRAWL_TTL_SECONDS = int(os.getenv("CRAWL_TTL_SECONDS", 120))
+CRAWL_CACHE_SIZE = 64
+_crawl_cache = OrderedDict()
+
+
+def invalidate_crawl_cache(start_url):
+    """Drop every cached crawl that started from start_url."""
+    for key in [k for k in list(_crawl_cache) if k[0] == start_url]:
+        _crawl_cache.pop(key, None)
+
 
 # ------------------ Helper: Domain Validator ------------------
 def is_valid_url(url, base_domain):
@@ -25,17 +78,24 @@ def is_valid_url(url, base_domain):
 
 
 # ------------------ Helper: Robots.txt Check ------------------
+@functools.lru_cache(maxsize=256)
+def _get_rp(robots_url):
+    """Fetch and parse robots.txt once per domain."""
+    rp = robotparser.RobotFileParser()
+    rp.set_url(robots_url)
+    rp.read()
+    return rp
+
+
 def is_allowed_by_robots(url):
     """Check robots.txt for crawling permissions."""
     parsed = urlparse(url)
     base_url = f"{parsed.scheme}://{parsed.netloc}/robots.txt"
-    rp = robotparser.RobotFileParser()
     os.makedirs("logs", exist_ok=True)
     log_path = "logs/robots_log.txt"
 
     try:
-        rp.set_url(base_url)
-        rp.read()
+        rp = _get_rp(base_url)
         allowed = rp.can_fetch("*", url)
         if not allowed:
             print(f"🚫 Disallowed by robots.txt: {url}")
@@ -57,14 +117,15 @@ def rank_text_by_query(text, query):
     """Ranks text chunks based on keyword overlap with query."""
     if not query:
         return text
-    paragraphs = [p.strip() for p in text.split(".") if len(p.split()) > 6]
-    query_words = set(query.lower().split())
-    ranked = sorted(
-        paragraphs,
-        key=lambda p: len(set(p.lower().split()) & query_words),
-        reverse=True,
-    )
-    return ". ".join(ranked[:6])  # top 6 relevant sections
+    query_words = frozenset(query.lower().split())
+    # Score each paragraph once: distinct query words it contains
+    scored = []
+    for p in text.split("."):
+        words = p.lower().split()
+        if len(words) > 6:
+            scored.append((len(query_words.intersection(words)), p.strip()))
+    scored.sort(key=lambda item: item[0], reverse=True)
+    return ". ".join(p for _, p in scored[:6])  # top 6 relevant sections
 
 
 # ------------------ Async HTML Fetcher ------------------
@@ -86,27 +147,37 @@ async def fetch_page(session, url, sem):
 
 
 # ------------------ HTML Cleaner ------------------
-def clean_text(html):
-    """Removes junk tags and extracts readable content."""
-    soup = BeautifulSoup(html, "html.parser")
-    for tag in soup(["script", "style", "nav", "footer", "header", "noscript", "aside", "form"]):
-        tag.decompose()
-    main = soup.find("main") or soup.find("article") or soup.find("body") or soup
+_TEXT_TAGS = frozenset(["h1", "h2", "h3", "p", "li", "div", "span"])
+
+
+def clean_text(tree):
+    """Removes junk tags and extracts readable content from a parsed page."""
+    tree.strip_tags(["script", "style", "nav", "footer", "header", "noscript", "aside", "form"])
+    main = tree.css_first("main") or tree.css_first("article") or tree.body or tree.root
+    if main is None:
+        return ""
     text_parts = []
-    for tag in main.find_all(["h1", "h2", "h3", "p", "li", "div", "span"]):
-        content = tag.get_text(strip=True)
+    # Walk in document order (css() with a selector list groups by selector);
+    # traverse() yields `main` first, which is not one of its own descendants
+    nodes = main.traverse()
+    next(nodes, None)
+    for node in nodes:
+        if node.tag not in _TEXT_TAGS:
+            continue
+        content = node.text(strip=True)
         if len(content.split()) > 5 and not content.startswith("©"):
             text_parts.append(content)
     return " ".join(text_parts)
 
 
 # ------------------ Extract Internal Links ------------------
-def extract_links(html, base_url, base_domain):
-    """Extracts links within the same domain."""
-    soup = BeautifulSoup(html, "html.parser")
+def extract_links(tree, base_url, base_domain):
+    """Extracts links within the same domain from a parsed page."""
     links = set()
-    for tag in soup.find_all("a", href=True):
-        href = tag["href"]
+    for node in tree.css("a[href]"):
+        href = node.attributes.get("href")
+        if not href:
+            continue
         full_url = urljoin(base_url, href)
         domain = urlparse(full_url).netloc
         if base_domain in domain:
@@ -114,90 +185,142 @@ def extract_links(html, base_url, base_domain):
     return list(links)
 
 
+# ------------------ Page Processing ------------------
+def process_html(html, url, base_domain, query="", follow_links=True):
+    """Parse a page once and return (ranked_text, links); ranked_text is None if the page has no text."""
+    tree = HTMLParser(html)
+    # Collect links before clean_text strips nav/header/footer
+    links = extract_links(tree, url, base_domain) if follow_links else []
+    text = clean_text(tree)
+    if not text:
+        return None, links
+    return rank_text_by_query(text, query), links
+
+
+# ------------------ Single URL Worker ------------------
+async def _process_url(session, sem, url, base_domain, query, follow_links):
+    """Robots check, fetch and process one URL; returns (allowed, ranked_text, links)."""
+    # Respect robots.txt (first lookup per domain hits the network)
+    if not await run_blocking(is_allowed_by_robots, url):
+        return False, None, []
+
+    html = await fetch_page(session, url, sem)
+    if not html:
+        return True, None, []
+
+    ranked_text, links = await run_blocking(process_html, html, url, base_domain, query, follow_links)
+    return True, ranked_text, links
+
+
 # ------------------ Main Async Crawler ------------------
 async def crawl_async(start_url, max_pages=50, max_depth=2, query=""):
+    cache_key = (start_url, max_pages, max_depth, query.lower().strip())
+    cached = _crawl_cache.get(cache_key)
+    if cached and time.time() - cached[2] < CRAWL_TTL_SECONDS:
+        _crawl_cache.move_to_end(cache_key)
+        print(f"♻️ Using cached crawl for: {start_url}")
+        return cached[0], cached[1]
+
     parsed = urlparse(start_url)
     base_domain = parsed.netloc
     visited, pages, blocked = set(), [], []
-    queue = [(start_url, 0)]
-    sem = asyncio.Semaphore(5)  # concurrency limit
+    queue = deque([(start_url, 0)])
+    enqueued = {start_url}
+    sem = asyncio.Semaphore(20)  # concurrency limit
 
     print(f"🌐 Starting async crawl from: {start_url}")
     print(f"📍 Restricting to domain: {base_domain}\n")
 
-    async with aiohttp.ClientSession() as session:
-        while queue and len(pages) < max_pages:
-            url, depth = queue.pop(0)
+    session = await _get_session()
+    while queue and len(pages) < max_pages:
+        # Next wave: at most as many URLs as pages still wanted, fetched concurrently
+        wave = []
+        while queue and len(wave) < max_pages - len(pages):
+            url, depth = queue.popleft()
             if url in visited or depth > max_depth:
                 continue
+            visited.add(url)
+            wave.append((url, depth))
+        if not wave:
+            break
 
-            # Respect robots.txt
-            if not is_allowed_by_robots(url):
+        results = await asyncio.gather(*[
+            _process_url(session, sem, url, base_domain, query, depth < max_depth)
+            for url, depth in wave
+        ])
+
+        early_stop = False
+        for (url, depth), (allowed, ranked_text, links) in zip(wave, results):
+            if not allowed:
                 blocked.append(url)
                 continue
-
-            html = await fetch_page(session, url, sem)
-            visited.add(url)
-            if not html:
+            if ranked_text is None or len(pages) >= max_pages:
                 continue
 
-            text = clean_text(html)
-            if text:
-                ranked_text = rank_text_by_query(text, query)
-                pages.append({"url": url, "content": ranked_text})
-                print(f"✅ Crawled: {url} ({len(ranked_text)} chars)")
-
-                # Early exit if query hits found
-                relevant_hits = sum(q in ranked_text.lower() for q in query.lower().split())
-                if relevant_hits >= 2:
-                    print("🧠 Early stop — sufficient relevant hits found.")
-                    break
-
-                # Crawl deeper
-                if depth < max_depth:
-                    links = extract_links(html, url, base_domain)
-                    for link in links:
-                        if link not in visited and len(queue) < max_pages and is_valid_url(link, base_domain):
-                            queue.append((link, depth + 1))
-            await asyncio.sleep(0.2)  # polite delay
+            pages.append({"url": url, "content": ranked_text})
+            print(f"✅ Crawled: {url} ({len(ranked_text)} chars)")
+
+            # Early exit if query hits found
+            relevant_hits = sum(q in ranked_text.lower() for q in query.lower().split())
+            if relevant_hits >= 2:
+                print("🧠 Early stop — sufficient relevant hits found.")
+                early_stop = True
+                break
+
+            # Crawl deeper
+            if depth < max_depth:
+                for link in links:
+                    if link not in enqueued and len(queue) < max_pages and is_valid_url(link, base_domain):
+                        enqueued.add(link)
+                        queue.append((link, depth + 1))
+        if early_stop:
+            break
+        await asyncio.sleep(0.2)  # polite delay between waves
 
     # Wikipedia fallback
     if not pages:
         brand = base_domain.replace("www.", "").split(".")[0]
         fallback = f"https://en.wikipedia.org/wiki/{brand.capitalize()}"
         print(f"⚠️ No crawlable data found — using Wikipedia fallback → {fallback}")
-        async with aiohttp.ClientSession() as session:
-            html = await fetch_page(session, fallback, sem)
-            if html:
-                text = clean_text(html)
-                ranked_text = rank_text_by_query(text, query)
-                pages.append({"url": fallback, "content": ranked_text})
+        html = await fetch_page(session, fallback, sem)
+        if html:
+            ranked_text, _ = await run_blocking(process_html, html, fallback, base_domain, query, False)
+            pages.append({"url": fallback, "content": ranked_text or ""})
 
     print(f"\n🔍 Crawl complete. Collected {len(pages)} pages. Blocked: {len(blocked)} URLs.\n")
 
     os.makedirs("data", exist_ok=True)
     timestamp = int(time.time())
     save_path = f"data/crawled_{base_domain}_{timestamp}.json"
-    with open(save_path, "w", encoding="utf-8") as f:
-        json.dump(pages, f, indent=2, ensure_ascii=False)
+    with open(save_path, "wb") as f:
+        f.write(orjson.dumps(pages))
     print(f"💾 Data saved to: {save_path}\n")
 
+    _crawl_cache[cache_key] = (pages, blocked, time.time())
+    _crawl_cache.move_to_end(cache_key)
+    if len(_crawl_cache) > CRAWL_CACHE_SIZE:
+        _crawl_cache.popitem(last=False)
+
     return pages, blocked
 
 
 # ------------------ Sync Wrapper for Flask ------------------
 def crawl_website(start_url, max_pages=10, max_depth=2, query=""):
     """Synchronous Flask-compatible wrapper."""
-    return asyncio.run(crawl_async(start_url, max_pages, max_depth, query))
+    async def _crawl():
+        try:
+            return await crawl_async(start_url, max_pages, max_depth, query)
+        finally:
+            await close_session()  # the session cannot outlive this loop
+
+    return asyncio.run(_crawl())
 
 
 # ------------------ Debug Mode ------------------
 if __name__ == "__main__":
-    asyncio.run(
-        crawl_async(
-            "https://www.python.org/",
-            max_pages=5,
-            max_depth=2,
-            query="What is Python used for?"
-        )
+    crawl_website(
+        "https://www.python.org/",
+        max_pages=5,
+        max_depth=2,
+        query="What is Python used for?"
     )
\ No newline at end of file
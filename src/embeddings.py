@@ -1,31 +1,109 @@
-from sentence_transformers import SentenceTransformer, CrossEncoder, util
+from sentence_transformers import SentenceTransformer, CrossEncoder
+from sklearn.feature_extraction.text import CountVectorizer
+import numpy as np
 import torch
-import json
+import hashlib
+import dbm.dumb
+import collections
+import contextlib
+import orjson
 import os
 import re
-import math
+import threading
+
+try:
+    import faiss
+except ImportError:  # optional: brute-force search is used without it
+    faiss = None
+
+QUERY_CACHE_SIZE = 1024
+ENCODE_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", 64))
+RERANK_BATCH_SIZE = 32
+# Below this many chunks a brute-force scan is as fast as an ANN lookup
+FAISS_MIN_CHUNKS = int(os.getenv("FAISS_MIN_CHUNKS", 1000))
+
+_WORD_RE = re.compile(r'\b\w{3,}\b')
+_WS_RE = re.compile(r'\s+')
+_SENT_RE = re.compile(r'(?<=[.!?]) +')
+
 
 class EmbeddingEngine:
-    def __init__(self, model_name="sentence-transformers/all-MiniLM-L6-v2"):
+    def __init__(self, model_name="sentence-transformers/all-MiniLM-L6-v2", cache_dir="data"):
         print(f"🧠 Loading bi-encoder model: {model_name}")
-        self.model = SentenceTransformer(model_name)
+        self.model_name = model_name
+        # GPU + fp16 when available; vectors are unit-normalized at encode time
+        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.emb_dtype = torch.float16 if self.device == "cuda" else torch.float32
+        self.model = SentenceTransformer(model_name, device=self.device)
+        if self.device == "cuda":
+            self.model.half()
         print("🤖 Loading cross-encoder reranker (ms-marco-MiniLM-L-6-v2)...")
         self.reranker = CrossEncoder("cross-encoder/ms-marco-MiniLM-L-6-v2")
+        # rerank_results calls the underlying model directly, so place it once here
+        self.reranker.model.to(self.device).eval()
         self.embeddings = None
         self.text_chunks = []
         self.urls = []
-        self.query_cache = {}
+        self.chunk_to_urls = {}
+        self.vectorizer = None
+        self.chunk_term_mat = None
+        self.chunk_norms = None
+        self.faiss_index = None
+        self.searches_since_build = 0
+        self.query_cache = collections.OrderedDict()
+
+        # Persistent embedding caches (content hash → float32 bytes). dbm.dumb
+        # is the same on every platform: no gdbm writer lock (the Flask
+        # reloader opens it from two processes), no ndbm value-size limit.
+        # Flask serves requests on several threads, so all access is locked.
+        os.makedirs(cache_dir, exist_ok=True)
+        self._cache_lock = threading.Lock()
+        self.chunk_cache = dbm.dumb.open(os.path.join(cache_dir, "chunk_emb.dbm"), "c")
+        self.query_store = dbm.dumb.open(os.path.join(cache_dir, "query_emb.dbm"), "c")
+
+    def _cache_key(self, text):
+        """Content hash of a text, scoped to the current model."""
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).digest()
+
+    def _get_query_emb(self, query):
+        """Return the query embedding from the LRU / on-disk cache, encoding on miss."""
+        normalized = query.strip().lower()
+        key = self._cache_key(normalized)
+        with self._cache_lock:
+            if key in self.query_cache:
+                self.query_cache.move_to_end(key)
+                return self.query_cache[key]
+            cached = self.query_store.get(key)
+
+        if cached is not None:
+            query_emb = torch.nn.functional.normalize(torch.from_numpy(np.frombuffer(cached, dtype=np.float32).copy()), dim=0)
+        else:
+            query_emb = self.model.encode(normalized, convert_to_tensor=True, normalize_embeddings=True)
+            with self._cache_lock:
+                self.query_store[key] = query_emb.cpu().numpy().astype(np.float32).tobytes()
+        query_emb = query_emb.to(self.device, dtype=self.emb_dtype)
+
+        with self._cache_lock:
+            self.query_cache[key] = query_emb
+            if len(self.query_cache) > QUERY_CACHE_SIZE:
+                self.query_cache.popitem(last=False)
+        return query_emb
 
     # -------------------------------------------------------
     # 🧩 Text Chunking
     # -------------------------------------------------------
     def chunk_text(self, text, max_length=300):
         """Split text into small readable chunks."""
-        text = re.sub(r'\s+', ' ', text).strip()
+        text = _WS_RE.sub(' ', text).strip()
         if not text or len(text) < 50:
             return []
+        # Short texts (and single sentences) are already one chunk
+        if len(text) <= max_length:
+            return [text]
 
-        sentences = re.split(r'(?<=[.!?]) +', text)
+        sentences = _SENT_RE.split(text)
+        if len(sentences) == 1:
+            return [text]
         chunks, current_chunk = [], ""
 
         for sent in sentences:
@@ -47,39 +125,141 @@ class EmbeddingEngine:
         print("⚙️ Building embeddings with semantic context...")
         self.text_chunks = []
         self.urls = []
+        self.chunk_to_urls = {}
 
+        # Identical chunks (shared boilerplate) are embedded once; every
+        # source URL is kept in chunk_to_urls
+        chunk_ids = {}
         for page in pages:
             content = page.get("content", "").strip()
             if not content:
                 continue
-            chunks = self.chunk_text(content)
-            if chunks:
-                self.text_chunks.extend(chunks)
-                self.urls.extend([page.get("url", "unknown")] * len(chunks))
+            url = page.get("url", "unknown")
+            for chunk in self.chunk_text(content):
+                h = hashlib.blake2b(chunk.encode("utf-8"), digest_size=16).digest()
+                idx = chunk_ids.get(h)
+                if idx is None:
+                    idx = chunk_ids[h] = len(self.text_chunks)
+                    self.text_chunks.append(chunk)
+                    self.urls.append(url)
+                    self.chunk_to_urls[idx] = [url]
+                elif url not in self.chunk_to_urls[idx]:
+                    self.chunk_to_urls[idx].append(url)
 
         if len(self.text_chunks) == 0:
             print("⚠️ No valid text found. Skipping embedding build.")
             self.embeddings = None
             return
 
-        self.embeddings = self.model.encode(self.text_chunks, convert_to_tensor=True, show_progress_bar=True)
+        # Reuse cached vectors, encode only the misses in one pass
+        dim = self.model.get_sentence_embedding_dimension()
+        embeddings = torch.empty((len(self.text_chunks), dim), dtype=torch.float32)
+        uncached_texts, uncached_indices, uncached_keys = [], [], []
+        with self._cache_lock:
+            for i, chunk in enumerate(self.text_chunks):
+                key = self._cache_key(chunk)
+                cached = self.chunk_cache.get(key)
+                if cached is not None:
+                    embeddings[i] = torch.from_numpy(np.frombuffer(cached, dtype=np.float32).copy())
+                else:
+                    uncached_texts.append(chunk)
+                    uncached_indices.append(i)
+                    uncached_keys.append(key)
+
+        if uncached_texts:
+            # encode() already length-sorts its input (smart batching), so
+            # mini-batches are padded only to their own longest chunk.
+            new_embs = self.model.encode(
+                uncached_texts,
+                convert_to_tensor=True,
+                normalize_embeddings=True,
+                batch_size=ENCODE_BATCH_SIZE,
+                show_progress_bar=len(uncached_texts) > ENCODE_BATCH_SIZE,
+            )
+            new_embs = new_embs.float().cpu()
+            embeddings[uncached_indices] = new_embs
+            with self._cache_lock:
+                # No sync(): dbm.dumb appends each new key to .dir on write,
+                # while sync() would rewrite the whole index every build
+                for key, emb in zip(uncached_keys, new_embs):
+                    self.chunk_cache[key] = emb.numpy().tobytes()
+
+        print(f"♻️ Reused {len(self.text_chunks) - len(uncached_texts)} cached, embedded {len(uncached_texts)} new chunks.")
+        # Unit rows make cosine a plain dot product (also normalizes older cache entries)
+        embeddings = torch.nn.functional.normalize(embeddings, dim=1)
+        self.embeddings = embeddings.to(self.device, dtype=self.emb_dtype)
+        self._build_keyword_index()
+
+        # The ANN index is built lazily in search() once it will be reused
+        self.faiss_index = None
+        self.searches_since_build = 0
+
         print(f"✅ Indexed {len(self.text_chunks)} chunks from {len(pages)} pages.")
         os.makedirs("data", exist_ok=True)
-        with open("data/embeddings.json", "w", encoding="utf-8") as f:
-            json.dump({"chunks": self.text_chunks, "urls": self.urls}, f, ensure_ascii=False, indent=2)
+        with open("data/embeddings.json", "wb") as f:
+            f.write(orjson.dumps({"chunks": self.text_chunks, "urls": self.urls}))
         print("💾 Embeddings saved to data/embeddings.json")
 
     # -------------------------------------------------------
     # 🧮 Keyword Overlap
     # -------------------------------------------------------
-    def _keyword_overlap(self, query, text):
-        """Compute lexical overlap between query and text chunk."""
-        query_words = set(re.findall(r'\b\w{3,}\b', query.lower()))
-        text_words = set(re.findall(r'\b\w{3,}\b', text.lower()))
-        if not query_words or not text_words:
-            return 0.0
-        common = len(query_words & text_words)
-        return round(common / math.sqrt(len(query_words) * len(text_words)), 3)
+    def _build_keyword_index(self):
+        """Precompute a binary term-document matrix over the indexed chunks."""
+        self.vectorizer = CountVectorizer(token_pattern=_WORD_RE.pattern, binary=True, lowercase=True)
+        try:
+            self.chunk_term_mat = self.vectorizer.fit_transform(self.text_chunks).astype(np.float32)
+        except ValueError:  # no chunk has a 3+ letter word
+            self.vectorizer = self.chunk_term_mat = self.chunk_norms = None
+            return
+        self.chunk_norms = np.sqrt(self.chunk_term_mat.sum(axis=1)).A1
+
+    def _keyword_scores(self, query, indices=None):
+        """Lexical overlap |Q∩T| / sqrt(|Q|·|T|) for every chunk, or only the given indices."""
+        size = len(self.text_chunks) if indices is None else len(indices)
+        # |Q| counts every query term, including ones absent from the vocabulary
+        query_terms = set(self.vectorizer.build_analyzer()(query)) if self.vectorizer is not None else set()
+        if not query_terms:
+            return np.zeros(size, dtype=np.float32)
+        term_mat, norms = self.chunk_term_mat, self.chunk_norms
+        if indices is not None:
+            term_mat, norms = term_mat[indices], norms[indices]
+        q_vec = self.vectorizer.transform([query]).astype(np.float32)
+        common = (q_vec @ term_mat.T).toarray().ravel()
+        scores = common / (np.sqrt(len(query_terms)) * norms + 1e-9)
+        return np.round(scores, 3).astype(np.float32)
+
+    # -------------------------------------------------------
+    # 📐 Semantic Similarity
+    # -------------------------------------------------------
+    def _semantic_scores(self, query_emb):
+        """Cosine similarity between the query and every chunk, on the index's device."""
+        # Rows and query are unit-norm, so cosine is a single GEMV (BLAS on CPU)
+        return torch.mv(self.embeddings, query_emb)
+
+    def _maybe_build_ann(self):
+        """Build the HNSW index on the second search against the same corpus.
+
+        Graph construction costs far more than one brute-force GEMV, so a
+        build_index() followed by a single search never pays for it.
+        """
+        self.searches_since_build += 1
+        if (faiss is None or self.faiss_index is not None or self.searches_since_build < 2
+                or len(self.text_chunks) < FAISS_MIN_CHUNKS):
+            return
+        unit = self.embeddings.float().cpu().numpy()
+        index = faiss.IndexHNSWFlat(unit.shape[1], 32, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efSearch = 64
+        index.add(np.ascontiguousarray(unit, dtype=np.float32))
+        self.faiss_index = index
+        print(f"🗂️ Built HNSW index over {index.ntotal} chunks.")
+
+    def _ann_candidates(self, query_emb, k):
+        """Top-k chunk indices and cosine scores from the HNSW index."""
+        q = query_emb.float().cpu().numpy().reshape(1, -1).copy()
+        faiss.normalize_L2(q)
+        scores, indices = self.faiss_index.search(q, k)
+        found = indices[0] >= 0  # HNSW pads with -1 when fewer than k hits
+        return indices[0][found], torch.from_numpy(scores[0][found])
 
     # -------------------------------------------------------
     # 🔍 Hybrid Search (Semantic + Keyword)
@@ -91,43 +271,38 @@ class EmbeddingEngine:
 
         print(f"\n🔎 Searching for: '{query}'")
 
-        # Cache query embedding
-        if query in self.query_cache:
-            query_emb = self.query_cache[query]
-        else:
-            query_emb = self.model.encode(query, convert_to_tensor=True)
-            self.query_cache[query] = query_emb
-
-        # Semantic similarity
-        semantic_scores = util.cos_sim(query_emb, self.embeddings)[0].detach().cpu()
+        query_emb = self._get_query_emb(query)
+        self._maybe_build_ann()
 
-        # Keyword overlap
-        keyword_scores = torch.tensor(
-            [self._keyword_overlap(query, chunk) for chunk in self.text_chunks],
-            dtype=torch.float32
-        )
-
-        # Align shapes safely
-        min_len = min(len(semantic_scores), len(keyword_scores))
-        semantic_scores = semantic_scores[:min_len]
-        keyword_scores = keyword_scores[:min_len]
+        # Semantic similarity: ANN shortlist on large corpora, full scan otherwise
+        candidates = None
+        if self.faiss_index is not None:
+            candidates, semantic_scores = self._ann_candidates(query_emb, top_k * 3)
+        else:
+            semantic_scores = self._semantic_scores(query_emb)
 
-        # Weighted combination
-        hybrid_scores = (semantic_scores * hybrid_weight) + (keyword_scores * (1 - hybrid_weight))
+        # Keyword overlap (only over the shortlist when there is one)
+        semantic_scores = semantic_scores.float()
+        keyword_scores = torch.from_numpy(self._keyword_scores(query, candidates)).to(semantic_scores.device)
 
-        # Flatten and get top results
-        hybrid_scores = hybrid_scores.flatten()
-        top_results = torch.topk(hybrid_scores, k=min(top_k * 3, hybrid_scores.numel()))  # fetch more before rerank
+        # Weighted combination + top-k stay on the scores' device; copy back once
+        hybrid_scores = torch.lerp(keyword_scores, semantic_scores, hybrid_weight)
+        top_scores, top_pos = torch.topk(hybrid_scores, k=min(top_k * 3, hybrid_scores.numel()))  # fetch more before rerank
+        top_final, top_sem, top_kw = torch.stack(
+            (top_scores, semantic_scores[top_pos], keyword_scores[top_pos])
+        ).tolist()
 
         results = []
-        for idx, score in zip(top_results.indices.tolist(), top_results.values.tolist()):
+        for pos, sem, kw, score in zip(top_pos.tolist(), top_sem, top_kw, top_final):
             if score >= min_score:
+                idx = int(candidates[pos]) if candidates is not None else pos
                 results.append({
                     "url": self.urls[idx],
+                    "sources": self.chunk_to_urls[idx],
                     "content": self.text_chunks[idx],
-                    "semantic_score": float(semantic_scores[idx]),
-                    "keyword_score": float(keyword_scores[idx]),
-                    "final_score": float(score)
+                    "semantic_score": sem,
+                    "keyword_score": kw,
+                    "final_score": score
                 })
 
         print(f"✅ Retrieved {len(results)} candidate chunks before reranking.")
@@ -146,12 +321,47 @@ class EmbeddingEngine:
         if not results:
             return results
 
-        pairs = [(query, r["content"]) for r in results]
-        scores = self.reranker.predict(pairs)
+        # Length-sort pairs so each batch pads to similar lengths
+        order = np.argsort([len(r["content"].split()) for r in results], kind="stable")
+        docs = [results[i]["content"] for i in order]
+
+        # fp16 autocast on GPU; CPUs without native half math stay in fp32
+        precision = (
+            torch.autocast("cuda", dtype=torch.float16)
+            if torch.cuda.is_available() else contextlib.nullcontext()
+        )
+        with torch.inference_mode(), precision:
+            scores = self._cross_encode(query, docs)
 
-        for i, r in enumerate(results):
-            r["rerank_score"] = float(scores[i])
+        for score, i in zip(scores, order):
+            results[i]["rerank_score"] = float(score)
         results = sorted(results, key=lambda x: x["rerank_score"], reverse=True)
 
         print(f"🧩 Re-ranked {len(results)} results using cross-encoder.")
-        return results[:top_k]
\ No newline at end of file
+        return results[:top_k]
+
+    def _cross_encode(self, query, docs):
+        """Score (query, doc) pairs, tokenizing the query once for all docs."""
+        tokenizer = self.reranker.tokenizer
+        model = self.reranker.model
+        device = next(model.parameters()).device
+        max_length = self.reranker.max_length or tokenizer.model_max_length
+
+        # [CLS] q [SEP] d [SEP], with docs truncated to what the query leaves
+        q_ids = tokenizer(query, add_special_tokens=False, truncation=True, max_length=max_length // 2)["input_ids"]
+        doc_budget = max(1, max_length - len(q_ids) - tokenizer.num_special_tokens_to_add(pair=True))
+        doc_ids = tokenizer(docs, add_special_tokens=False, truncation=True, max_length=doc_budget)["input_ids"]
+        use_token_types = "token_type_ids" in tokenizer.model_input_names
+
+        scores = []
+        for start in range(0, len(doc_ids), RERANK_BATCH_SIZE):
+            batch = {"input_ids": [], "token_type_ids": []}
+            for d_ids in doc_ids[start:start + RERANK_BATCH_SIZE]:
+                batch["input_ids"].append(tokenizer.build_inputs_with_special_tokens(q_ids, d_ids))
+                batch["token_type_ids"].append(tokenizer.create_token_type_ids_from_sequences(q_ids, d_ids))
+            if not use_token_types:
+                del batch["token_type_ids"]
+            features = tokenizer.pad(batch, return_tensors="pt").to(device)
+            logits = model(**features).logits
+            scores.extend(self.reranker.default_activation_function(logits)[:, 0].float().tolist())
+        return scores
\ No newline at end of file
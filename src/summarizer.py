@@ -1,13 +1,7 @@
 from transformers import pipeline
 import os
-import re
-import nltk
+from utils import CITE_RE, TOKEN_RE, WS_RE, deduplicate_sentences, split_sentences
 
-# Ensure sentence tokenizer is ready
-try:
-    nltk.data.find('tokenizers/punkt')
-except LookupError:
-    nltk.download('punkt')
 
 class Summarizer:
     def __init__(self):
@@ -30,9 +24,7 @@ class Summarizer:
     # -------------------------------------------------------
     def _clean_text(self, text):
         """Removes extra whitespace and citations."""
-        text = re.sub(r'\s+', ' ', text).strip()
-        text = re.sub(r'\[[0-9]+\]', '', text)
-        return text
+        return CITE_RE.sub("", WS_RE.sub(" ", text).strip())
 
     # -------------------------------------------------------
     # ✂️ Chunk Long Text
@@ -42,33 +34,28 @@ class Summarizer:
         if len(text) <= max_len:
             return [text]
 
-        sentences = nltk.sent_tokenize(text)
-        chunks, current = [], ""
+        sentences = split_sentences(text)
+        chunks, buf, cur_len = [], [], 0
 
+        # Collect sentences and join once per chunk (no repeated string +=)
         for sent in sentences:
-            if len(current) + len(sent) < max_len:
-                current += " " + sent
+            if cur_len + len(sent) + 1 < max_len:
+                buf.append(sent)
+                cur_len += len(sent) + 1
             else:
-                chunks.append(current.strip())
-                current = sent
-        if current:
-            chunks.append(current.strip())
+                if buf:
+                    chunks.append(" ".join(buf))
+                buf, cur_len = [sent], len(sent)
+        if buf:
+            chunks.append(" ".join(buf))
         return chunks
 
     # -------------------------------------------------------
     # 🧩 Deduplicate Similar Sentences
     # -------------------------------------------------------
     def _deduplicate_sentences(self, text):
-        """Removes repeated or near-identical lines."""
-        sentences = nltk.sent_tokenize(text)
-        seen = set()
-        filtered = []
-        for sent in sentences:
-            cleaned = sent.lower().strip()
-            if cleaned not in seen and len(cleaned) > 25:
-                seen.add(cleaned)
-                filtered.append(sent)
-        return " ".join(filtered)
+        """Removes repeated or near-identical lines (shared SimHash dedup)."""
+        return deduplicate_sentences(text)
 
     # -------------------------------------------------------
     # 💡 Query-Aware Summarization
@@ -114,11 +101,12 @@ class Summarizer:
             combined_summary = " ".join(summaries).strip()
 
             # If query provided, prioritize lines that actually answer it
-            if query:
-                query_terms = query.lower().split()
+            qset = frozenset(TOKEN_RE.findall(query.lower())) if query else frozenset()
+            if qset:
+                # One set intersection per sentence instead of one scan per term
                 relevant = [
-                    s for s in nltk.sent_tokenize(combined_summary)
-                    if any(q in s.lower() for q in query_terms)
+                    s for s in split_sentences(combined_summary)
+                    if qset & frozenset(TOKEN_RE.findall(s.lower()))
                 ]
                 if relevant:
                     combined_summary = " ".join(relevant)
@@ -1,23 +1,30 @@
 import os
-import re
-import nltk
+import hashlib
 import torch
 import asyncio
+from collections import OrderedDict
 from concurrent.futures import ThreadPoolExecutor
-from transformers import pipeline
+from transformers import (
+    AutoModelForSeq2SeqLM,
+    AutoTokenizer,
+    BitsAndBytesConfig,
+    GenerationConfig,
+    pipeline,
+)
+from utils import CITE_RE, TOKEN_RE, WS_RE, deduplicate_sentences, split_sentences
 
-# Ensure NLTK sentence tokenizer is ready
-try:
-    nltk.data.find('tokenizers/punkt')
-except LookupError:
-    nltk.download('punkt')
+SUMMARY_CACHE_SIZE = 1024
+# Upper bound on prompts per generate call (beam search memory grows with it)
+SUMMARY_BATCH_SIZE = int(os.getenv("SUMMARIZER_BATCH_SIZE", 8))
+# Cleaned text shorter than this is returned as-is instead of summarized
+MIN_SUMMARY_CHARS = int(os.getenv("SUMMARIZER_MIN_CHARS", 400))
 
 
 class AsyncSummarizer:
     def __init__(self):
         """
         ⚡ GPU-Aware Async Query-Aware Summarizer
-        Uses DistilBART and runs chunks concurrently.
+        Uses DistilBART and summarizes chunks in length-bucketed batched calls.
         """
         model_name = os.getenv("SUMMARIZER_MODEL", "sshleifer/distilbart-cnn-12-6")
 
@@ -26,90 +33,204 @@ class AsyncSummarizer:
         device_type = "GPU" if device == 0 else "CPU"
         print(f"🧠 Loading summarizer model ({model_name}) on {device_type}...")
 
-        # Load summarization pipeline
-        self.summarizer = pipeline(
-            "summarization",
-            model=model_name,
-            tokenizer=model_name,
-            device=device
-        )
+        # Optional quantized backends (SUMMARIZER_QUANT):
+        #   int8 → bitsandbytes 8-bit weights on GPU, dynamic int8 Linear layers on CPU
+        #   ct2  → CTranslate2 int8 model converted ahead of time (see README)
+        quant = os.getenv("SUMMARIZER_QUANT", "").lower()
+        if quant not in ("", "int8", "ct2"):
+            raise ValueError(f"Unsupported SUMMARIZER_QUANT={quant!r} (expected 'int8' or 'ct2')")
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.summarizer = None
+        self.ct2_translator = None
+
+        if quant == "ct2":
+            import ctranslate2
+            ct2_dir = os.getenv("SUMMARIZER_CT2_DIR", "models/distilbart-cnn-12-6-ct2")
+            print(f"⚡ Using CTranslate2 int8 model from {ct2_dir}")
+            self.ct2_translator = ctranslate2.Translator(
+                ct2_dir, device="cuda" if device == 0 else "cpu", compute_type="int8"
+            )
+            # Decode with the same beam settings the HF model ships with
+            self.generation_config = GenerationConfig.from_pretrained(model_name)
+        else:
+            # Load the model explicitly: fp16 on GPU halves memory traffic,
+            # CPU stays in fp32 (half-precision generation is slower there)
+            load_kwargs = {"torch_dtype": torch.float16 if device == 0 else torch.float32}
+            pipeline_device = device
+            if quant == "int8" and device == 0:
+                load_kwargs = {"quantization_config": BitsAndBytesConfig(load_in_8bit=True), "device_map": {"": 0}}
+                pipeline_device = None  # already placed by device_map
+            model = AutoModelForSeq2SeqLM.from_pretrained(model_name, **load_kwargs)
+            if quant == "int8" and device != 0:
+                model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+            model.eval()
 
-        # Thread pool for async execution (even GPU ops)
-        self.executor = ThreadPoolExecutor(max_workers=4)
+            # Load summarization pipeline
+            self.summarizer = pipeline(
+                "summarization",
+                model=model,
+                tokenizer=self.tokenizer,
+                device=pipeline_device
+            )
+
+        # Thread pool for model generation only. Concurrency comes from batching
+        # prompts into one generate call, not from threads: a single GPU
+        # serializes them anyway, and on CPU torch's intra-op threads
+        # already use every core, so extra workers only oversubscribe.
+        cpu_count = os.cpu_count() or 1
+        workers = 1 if device == 0 else max(1, min(2, cpu_count // 4))
+        torch.set_num_threads(max(1, cpu_count // workers))
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+        # LRU of finished summaries: (prompt hash, max_len, min_len) → text
+        self.summary_cache = OrderedDict()
 
     # -------------------------------------------------------
     # 🧹 Text Cleanup Helpers
     # -------------------------------------------------------
     def _clean_text(self, text):
         """Remove extra whitespace and citations."""
-        text = re.sub(r'\s+', ' ', text).strip()
-        text = re.sub(r'\[[0-9]+\]', '', text)
-        return text
+        return CITE_RE.sub("", WS_RE.sub(" ", text).strip())
 
     def _chunk_text(self, text, max_len=3000):
         """Split text into smaller segments."""
         if len(text) <= max_len:
             return [text]
 
-        sentences = nltk.sent_tokenize(text)
-        chunks, current = [], ""
+        sentences = split_sentences(text)
+        chunks, buf, cur_len = [], [], 0
 
+        # Collect sentences and join once per chunk (no repeated string +=)
         for sent in sentences:
-            if len(current) + len(sent) < max_len:
-                current += " " + sent
+            if cur_len + len(sent) + 1 < max_len:
+                buf.append(sent)
+                cur_len += len(sent) + 1
             else:
-                chunks.append(current.strip())
-                current = sent
-        if current:
-            chunks.append(current.strip())
+                if buf:
+                    chunks.append(" ".join(buf))
+                buf, cur_len = [sent], len(sent)
+        if buf:
+            chunks.append(" ".join(buf))
         return chunks
 
     def _deduplicate_sentences(self, text):
-        """Eliminate duplicate or near-identical sentences."""
-        sentences = nltk.sent_tokenize(text)
-        seen, filtered = set(), []
-        for sent in sentences:
-            cleaned = sent.lower().strip()
-            if cleaned not in seen and len(cleaned) > 25:
-                seen.add(cleaned)
-                filtered.append(sent)
-        return " ".join(filtered)
+        """Eliminate duplicate or near-identical sentences (SimHash within a few bits)."""
+        return deduplicate_sentences(text)
+
+    def _prepare(self, text):
+        """Clean → dedupe → chunk (blocking; runs on the default pool)."""
+        text = self._clean_text(text)
+        text = self._deduplicate_sentences(text)
+        return self._chunk_text(text)
+
+    def _length_budget(self, prompt):
+        """(max_len, min_len) generation budget for a prompt.
+
+        Rounded up to steps of 20 tokens so similar chunks share a batch.
+        """
+        max_len = min(200, max(60, -(-len(prompt) // 500) * 20))
+        return max_len, max(30, max_len // 3)
+
+    def _relevant_sentences(self, summary, query):
+        """Sentences of `summary` sharing at least one word with the query."""
+        qset = frozenset(TOKEN_RE.findall(query.lower()))
+        if not qset:
+            return []
+        return [
+            s for s in split_sentences(summary)
+            if qset & frozenset(TOKEN_RE.findall(s.lower()))
+        ]
 
     # -------------------------------------------------------
     # ⚙️ Core Async Summarization Logic
     # -------------------------------------------------------
-    async def _summarize_chunk(self, prompt, max_len, min_len):
-        """Run a single chunk summarization asynchronously."""
-        loop = asyncio.get_event_loop()
-        result = await loop.run_in_executor(
-            self.executor,
-            lambda: self.summarizer(
-                prompt,
+    def _generate(self, prompts, max_len, min_len):
+        """Blocking batched generation (runs on the executor)."""
+        if self.ct2_translator is not None:
+            return self._generate_ct2(prompts, max_len, min_len)
+
+        with torch.inference_mode():
+            results = self.summarizer(
+                prompts,
                 max_length=max_len,
                 min_length=min_len,
+                batch_size=min(len(prompts), SUMMARY_BATCH_SIZE),
+                truncation=True,
                 do_sample=False,
             )
+        return [r["summary_text"] for r in results]
+
+    def _generate_ct2(self, prompts, max_len, min_len):
+        """Batched generation through the CTranslate2 model."""
+        gen = self.generation_config
+        tokens = [
+            self.tokenizer.convert_ids_to_tokens(self.tokenizer.encode(p, truncation=True))
+            for p in prompts
+        ]
+        results = self.ct2_translator.translate_batch(
+            tokens,
+            max_batch_size=SUMMARY_BATCH_SIZE,
+            beam_size=gen.num_beams or 1,
+            length_penalty=gen.length_penalty,
+            no_repeat_ngram_size=gen.no_repeat_ngram_size or 0,
+            max_decoding_length=max_len,
+            min_decoding_length=min_len,
         )
-        return result[0]["summary_text"]
+        return [
+            self.tokenizer.decode(
+                self.tokenizer.convert_tokens_to_ids(r.hypotheses[0]), skip_special_tokens=True
+            )
+            for r in results
+        ]
+
+    async def _summarize_batch(self, prompts, max_len, min_len):
+        """Summarize all prompts in one batched call, skipping cached ones."""
+        keys = [
+            (hashlib.blake2b(p.encode("utf-8")).digest(), max_len, min_len)
+            for p in prompts
+        ]
+        summaries = [None] * len(prompts)
+        misses = []
+        for i, key in enumerate(keys):
+            if key in self.summary_cache:
+                self.summary_cache.move_to_end(key)
+                summaries[i] = self.summary_cache[key]
+            else:
+                misses.append(i)
+
+        if misses:
+            loop = asyncio.get_running_loop()
+            generated = await loop.run_in_executor(
+                self.executor, self._generate, [prompts[i] for i in misses], max_len, min_len
+            )
+            for i, summary in zip(misses, generated):
+                summaries[i] = summary
+                self.summary_cache[keys[i]] = summary
+            while len(self.summary_cache) > SUMMARY_CACHE_SIZE:
+                self.summary_cache.popitem(last=False)
+        return summaries
 
     # -------------------------------------------------------
     # 🧩 Main Async Summarization
     # -------------------------------------------------------
     async def summarize(self, text, query=None):
         """
-        Summarizes text concurrently, aware of query and context.
+        Summarizes text in length-bucketed batches, aware of query and context.
         Auto-selects GPU if available.
         """
         if not text or not text.strip():
             return "No relevant content found."
 
-        text = self._clean_text(text)
-        text = self._deduplicate_sentences(text)
-        chunks = self._chunk_text(text)
+        # Regex + sentence tokenization is CPU-bound; keep it off the event loop.
+        # Default pool: self.executor is reserved for (possibly busy) generation.
+        loop = asyncio.get_running_loop()
+        chunks = await loop.run_in_executor(None, self._prepare, text)
 
-        print(f"🧩 Summarizing {len(chunks)} chunk(s) concurrently...")
+        # Already shorter than a summary would be: skip the model entirely
+        if len(chunks) == 1 and len(chunks[0]) < MIN_SUMMARY_CHARS:
+            return chunks[0] or "No relevant content found."
 
-        tasks = []
+        prompts = []
         for chunk in chunks:
             # Make summary more question-aware
             if query:
@@ -121,23 +242,44 @@ class AsyncSummarizer:
             else:
                 prompt = chunk
 
-            max_len = min(200, max(60, len(prompt) // 25))
-            min_len = max(30, max_len // 3)
+            prompts.append(prompt)
+
+        budgets = [self._length_budget(p) for p in prompts]
+
+        # A lone chunk barely longer than its own minimum summary: pass it through
+        if len(chunks) == 1 and len(chunks[0]) < budgets[0][1] * 4:
+            return chunks[0]
+
+        # Bucket prompts by length budget; each bucket is one batched call
+        buckets = {}
+        for i, budget in enumerate(budgets):
+            buckets.setdefault(budget, []).append(i)
+
+        print(f"🧩 Summarizing {len(chunks)} chunk(s) in {len(buckets)} batch(es)...")
+
+        async def run_bucket(indices, max_len, min_len):
+            parts = await self._summarize_batch([prompts[i] for i in indices], max_len, min_len)
+            return indices, parts
 
-            tasks.append(self._summarize_chunk(prompt, max_len, min_len))
+        summaries = [""] * len(prompts)
+        relevant = [[] for _ in prompts]
+        tasks = [run_bucket(indices, *budget) for budget, indices in buckets.items()]
 
-        # Run summarization tasks concurrently
-        summaries = await asyncio.gather(*tasks)
-        combined_summary = " ".join(summaries).strip()
+        # Filter each bucket as soon as it finishes rather than after the slowest
+        for next_done in asyncio.as_completed(tasks):
+            indices, parts = await next_done
+            for i, part in zip(indices, parts):
+                summaries[i] = part
+                if query:
+                    # Default pool: self.executor may still be busy generating
+                    relevant[i] = await loop.run_in_executor(
+                        None, self._relevant_sentences, part, query
+                    )
 
-        # Filter summary by query relevance
-        if query:
-            query_terms = query.lower().split()
-            relevant_sentences = [
-                s for s in nltk.sent_tokenize(combined_summary)
-                if any(q in s.lower() for q in query_terms)
-            ]
-            if relevant_sentences:
-                combined_summary = " ".join(relevant_sentences)
+        # Keep chunk order; fall back to everything if nothing matched the query
+        if any(relevant):
+            combined_summary = " ".join(s for sents in relevant for s in sents)
+        else:
+            combined_summary = " ".join(summaries).strip()
 
-        return combined_summary or "No clear answer could be derived."
\ No newline at end of file
+        return combined_summary or "No clear answer could be derived."
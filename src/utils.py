@@ -1,38 +1,190 @@
-import requests
+import asyncio
+import aiohttp
+import blingfire
+import numpy as np
+import os
+import re
+from collections import deque
+from urllib.parse import urldefrag, urljoin, urlparse
 from bs4 import BeautifulSoup
-from tqdm import tqdm
+from selectolax.parser import HTMLParser
 
-def crawl_website(start_url, max_pages=5):
-    visited = set()
-    to_visit = [start_url]
-    pages = []
+# "bs4" falls back to BeautifulSoup for sites selectolax mis-parses
+PARSER = os.getenv("CRAWLER_PARSER", "selectolax").lower()
+USER_AGENT = "Mozilla/5.0 (compatible; RAGSmartSearch/1.0)"
 
-    print(f"🌐 Crawling started from: {start_url}\n")
+# Links with these extensions are never HTML, so don't fetch them at all
+SKIP_EXTENSIONS = (
+    ".pdf", ".jpg", ".jpeg", ".png", ".gif", ".svg", ".webp", ".ico",
+    ".zip", ".gz", ".tar", ".mp3", ".mp4", ".avi", ".mov",
+    ".css", ".js", ".json", ".xml", ".doc", ".docx", ".xls", ".xlsx", ".ppt", ".pptx",
+)
+
+# Text helpers shared by both summarizers
+WS_RE = re.compile(r"\s+")
+CITE_RE = re.compile(r"\[[0-9]+\]")
+TOKEN_RE = re.compile(r"\w+")
+
+SIMHASH_MAX_DISTANCE = 3  # differing bits still counted as "near-identical"
+SIMHASH_BANDS = 4  # 16-bit bands; distance <= 3 leaves at least one band identical
+_MASK64 = (1 << 64) - 1
+
+
+def make_session():
+    """Pooled aiohttp session for crawl_website (create inside a running loop)."""
+    connector = aiohttp.TCPConnector(limit=16, limit_per_host=16, ttl_dns_cache=300)
+    return aiohttp.ClientSession(
+        connector=connector,
+        timeout=aiohttp.ClientTimeout(total=5),
+        headers={"User-Agent": USER_AGENT},
+    )
+
+
+def canonicalize_url(url):
+    """Dedup key: drop the fragment and trailing slash so equivalent URLs compare equal.
 
-    while to_visit and len(pages) < max_pages:
-        url = to_visit.pop(0)
-        if url in visited:
+    Only for the visited set; never resolve links against it (``/a/`` and
+    ``/a`` resolve relative links differently).
+    """
+    parsed = urlparse(urldefrag(url)[0])
+    return parsed._replace(path=parsed.path.rstrip("/") or "/").geturl()
+
+
+def _is_crawlable(url):
+    """True for http(s) URLs that don't point at an obvious non-HTML file."""
+    parsed = urlparse(url)
+    return parsed.scheme in ("http", "https") and not parsed.path.lower().endswith(SKIP_EXTENSIONS)
+
+
+def _parse_page(html, base_url):
+    """Extract visible text and absolute links, resolved against the page's final URL."""
+    if PARSER == "bs4":
+        soup = BeautifulSoup(html, "html.parser")
+        text = soup.get_text(separator=" ", strip=True)
+        hrefs = [link["href"] for link in soup.find_all("a", href=True)]
+    else:
+        tree = HTMLParser(html)
+        # Unlike bs4's get_text(), selectolax's .text() includes inline code
+        tree.strip_tags(["script", "style", "noscript"])
+        root = tree.body or tree.root
+        text = root.text(separator=" ", strip=True) if root is not None else ""
+        hrefs = [node.attributes.get("href") for node in tree.css("a[href]")]
+    links = []
+    for href in hrefs:
+        if not href:
             continue
+        full_url = urljoin(base_url, href)
+        if _is_crawlable(full_url):
+            links.append(urldefrag(full_url)[0])
+    return text, links
 
+
+async def _fetch(session, sem, url):
+    """GET a page, returning (final URL after redirects, HTML) or None."""
+    async with sem:
         try:
-            response = requests.get(url, timeout=5)
-            if response.status_code != 200:
-                continue
-
-            soup = BeautifulSoup(response.text, "html.parser")
-            text = soup.get_text(separator=" ", strip=True)
-            pages.append({"url": url, "content": text})
-            visited.add(url)
-
-            # collect more links to crawl
-            for link in soup.find_all("a", href=True):
-                href = link["href"]
-                if href.startswith("http") and href not in visited:
-                    to_visit.append(href)
-
-            print(f"✅ Crawled: {url} ({len(text.split())} words)")
+            async with session.get(url) as response:
+                # Headers arrive before the body; bail out on non-HTML unread
+                if response.status != 200 or response.content_type != "text/html":
+                    return None
+                return str(response.url), await response.text()
         except Exception as e:
             print(f"❌ Failed: {url} | Error: {e}")
+            return None
+
+
+async def crawl_website(start_url, max_pages=5, session=None):
+    """Crawl from start_url; pass a make_session() session to reuse connections across crawls."""
+    visited = {canonicalize_url(start_url)}  # canonical keys of every URL ever enqueued
+    crawled = set()  # canonical keys of fetched pages (after redirects)
+    to_visit = deque([start_url])
+    pages = []
+    sem = asyncio.Semaphore(16)  # politeness limit
+    loop = asyncio.get_running_loop()
+
+    print(f"🌐 Crawling started from: {start_url}\n")
+
+    # No caller-owned session: pool connections for this crawl only
+    own_session = session is None
+    if own_session:
+        session = make_session()
+    try:
+        while to_visit and len(pages) < max_pages:
+            # Fetch the next wave of queued URLs concurrently
+            batch = []
+            while to_visit and len(batch) < max_pages - len(pages):
+                batch.append(to_visit.popleft())
+
+            responses = await asyncio.gather(*[_fetch(session, sem, url) for url in batch])
+            fetched = [resp for resp in responses if resp is not None]
+
+            # Parsing is CPU-bound; keep it off the event loop
+            parsed = await asyncio.gather(*[
+                loop.run_in_executor(None, _parse_page, html, url) for url, html in fetched
+            ])
+
+            for (url, _), (text, links) in zip(fetched, parsed):
+                if len(pages) >= max_pages:
+                    break
+                key = canonicalize_url(url)
+                if key in crawled:  # two links redirected to the same page
+                    continue
+                crawled.add(key)
+                visited.add(key)
+                pages.append({"url": url, "content": text})
+
+                # collect more links to crawl
+                for href in links:
+                    key = canonicalize_url(href)
+                    if key not in visited:
+                        visited.add(key)
+                        to_visit.append(href)
+
+                print(f"✅ Crawled: {url} ({len(text.split())} words)")
+    finally:
+        if own_session:
+            await session.close()
 
     print(f"\n🔍 Crawling completed. {len(pages)} pages collected.\n")
-    return pages
\ No newline at end of file
+    return pages
+
+
+def split_sentences(text):
+    """Split text into sentences with blingfire (no tokenizer data to download)."""
+    return [s for s in blingfire.text_to_sentences(text).split("\n") if s]
+
+
+def _simhash(tokens):
+    """64-bit SimHash over word 3-gram shingles."""
+    shingles = list(zip(tokens, tokens[1:], tokens[2:])) or [tuple(tokens)]
+    hashes = np.fromiter((hash(sh) & _MASK64 for sh in shingles), dtype=np.uint64, count=len(shingles))
+    bits = np.unpackbits(hashes.view(np.uint8)).reshape(-1, 64)
+    # Majority vote per bit position
+    votes = bits.sum(axis=0) * 2 > len(shingles)
+    return int.from_bytes(np.packbits(votes).tobytes(), "big")
+
+
+def deduplicate_sentences(text):
+    """Drop short, repeated and near-identical sentences (SimHash within a few bits)."""
+    seen, filtered = set(), []
+    # Per band: 16-bit band value → fingerprints kept so far. Only fingerprints
+    # sharing a band can be within SIMHASH_MAX_DISTANCE, so only those are checked.
+    bands = [{} for _ in range(SIMHASH_BANDS)]
+    for sent in split_sentences(text):
+        cleaned = sent.lower().strip()
+        if len(cleaned) <= 25 or cleaned in seen:
+            continue
+        tokens = TOKEN_RE.findall(cleaned)
+        fp = _simhash(tokens) if tokens else 0
+        keys = [(fp >> (16 * b)) & 0xFFFF for b in range(SIMHASH_BANDS)]
+        if any(
+            bin(fp ^ other).count("1") <= SIMHASH_MAX_DISTANCE
+            for band, key in zip(bands, keys)
+            for other in band.get(key, ())
+        ):
+            continue
+        seen.add(cleaned)
+        filtered.append(sent)
+        for band, key in zip(bands, keys):
+            band.setdefault(key, []).append(fp)
+    return " ".join(filtered)
@@ -0,0 +1,30 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+pytest.importorskip("aiohttp")
+pytest.importorskip("orjson")
+selectolax_parser = pytest.importorskip("selectolax.parser")
+
+from crawler import clean_text  # noqa: E402
+
+
+def test_clean_text_keeps_document_order():
+    html = (
+        "<html><body><main>"
+        "<h2>First heading with enough words here</h2>"
+        "<p>First paragraph with enough words in it</p>"
+        "<h2>Second heading with enough words here</h2>"
+        "<p>Second paragraph with enough words in it</p>"
+        "</main></body></html>"
+    )
+    text = clean_text(selectolax_parser.HTMLParser(html))
+    assert text == (
+        "First heading with enough words here "
+        "First paragraph with enough words in it "
+        "Second heading with enough words here "
+        "Second paragraph with enough words in it"
+    )
@@ -0,0 +1,48 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+pytest.importorskip("aiohttp")
+pytest.importorskip("blingfire")
+pytest.importorskip("bs4")
+pytest.importorskip("selectolax")
+
+import utils  # noqa: E402
+
+
+def test_deduplicate_sentences_drops_near_duplicates():
+    text = (
+        "The quick brown fox jumps over the lazy dog near the river bank. "
+        "The quick brown fox jumps over the lazy dog near the river bank! "
+        "An entirely different sentence about databases and indexing."
+    )
+    assert utils.deduplicate_sentences(text) == (
+        "The quick brown fox jumps over the lazy dog near the river bank. "
+        "An entirely different sentence about databases and indexing."
+    )
+
+
+def test_canonicalize_url_drops_fragment_and_trailing_slash():
+    assert utils.canonicalize_url("https://x.org/a/#top") == "https://x.org/a"
+    assert utils.canonicalize_url("https://x.org/a?q=1#f") == "https://x.org/a?q=1"
+    assert utils.canonicalize_url("https://x.org") == "https://x.org/"
+
+
+def test_parse_page_resolves_links_against_directory_url():
+    html = (
+        '<html><body><p>Library index</p>'
+        '<a href="asyncio.html#top">asyncio</a>'
+        '<a href="../tutorial/">tutorial</a>'
+        '<a href="/img/logo.png">logo</a>'
+        '<a href="mailto:docs@python.org">mail</a>'
+        '</body></html>'
+    )
+    text, links = utils._parse_page(html, "https://docs.python.org/3/library/")
+    assert text.startswith("Library index")
+    assert links == [
+        "https://docs.python.org/3/library/asyncio.html",
+        "https://docs.python.org/3/tutorial/",
+    ]